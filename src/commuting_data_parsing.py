@@ -4,200 +4,252 @@ Description:
     This module is used to parse and process all the commute data information that is received.
 """
 
+import ast
 import os
+from concurrent.futures import ProcessPoolExecutor
 
 import numpy as np
+import orjson
 import pandas as pd
 from tqdm import tqdm
-import ast
 
 import economic_indicators as ei
 
+# Constants
+QUOTE_TRANSLATION = str.maketrans("'", '"')  # Turns Python literal quotes into JSON
+
 city_list = ei.get_city()
 
 
-def is_valid_for_literal_eval(route):
+def parse_route(route):
     """
-    Check if the given route string can be safely evaluated using ast.literal_eval.
+    Parse a route string returned by the transit API. The strings are Python literals that are almost always valid JSON
+    once single quotes are swapped for double quotes, so orjson is tried first and ast.literal_eval is the fallback.
 
-    :param route: A string that potentially represents a Python literal
+    :param route: A string that represents the list of steps of a route
 
-    :return: True if the route can be safely evaluated, False otherwise
+    :return: The parsed list of route steps, and whether the slow fallback parser was needed
     """
+    if not isinstance(route, str):
+        raise TypeError(f"route must be a string, got {type(route).__name__}")
     try:
-        if not isinstance(route, str):
-            return False
-        ast.literal_eval(route)
-        return True
-    except (ValueError, SyntaxError, TypeError):
-        return False
+        return orjson.loads(route.translate(QUOTE_TRANSLATION)), False
+    except orjson.JSONDecodeError:
+        return ast.literal_eval(route), True
 
 
-def merge_api_files():
+def merge_on_factorized_keys(left, right, keys):
     """
-    Merge all API files for each city.
+    Left-merge two dataframes on the given key columns. The keys are first factorized into integer codes shared by both
+    dataframes, so the join hashes small integers instead of the long listing titles and addresses.
+
+    :param left: The left dataframe, whose key columns are kept
+    :param right: The right dataframe, matched at most once per row of the left dataframe
+    :param keys: The names of the key columns
+
+    :return: The merged dataframe
+    """
+    left_codes = {}
+    right_codes = {}
+    for key in keys:
+        codes, _ = pd.factorize(pd.concat([left[key], right[key]], ignore_index=True))
+        left_codes[f"_k{key}"] = codes[: len(left)]
+        right_codes[f"_k{key}"] = codes[len(left) :]
+
+    merged = left.assign(**left_codes).merge(
+        right.drop(columns=keys).assign(**right_codes),
+        on=list(left_codes),
+        how="left",
+        validate="one_to_one",
+    )
+    return merged.drop(columns=list(left_codes))
+
+
+def merge_city_api_files(city):
+    """
+    Merge all API files for one city.
+
+    :param city: City name
     """
-    for c in range(len(city_list)):
-        city = city_list[c]
-        workplace_data = pd.read_excel(f"../data/workplace/{city}.xlsx")
-        for path in ["driving", "transit"]:
-            for w in range(4):
-                code = workplace_data.loc[w, "code"]
-                file_path = f"./data/api/api_{path}/{city}/{city}_{path}_{code}.xlsx"
-                if not os.path.exists(file_path):
-                    data1 = pd.read_excel(
-                        f"./data/api/api_{path}/{city}/{city}_{path}_{code}_1.xlsx"
-                    )
-                    data2 = pd.read_excel(
-                        f"./data/api/api_{path}/{city}/{city}_{path}_{code}_2.xlsx"
-                    )
+    workplace_data = pd.read_parquet(f"../data/workplace/{city}.parquet")
+    codes = workplace_data["code"].head(4).tolist()
+    for path in ["driving", "transit"]:
+        for code in codes:
+            file_path = f"./data/api/api_{path}/{city}/{city}_{path}_{code}"
+            if not os.path.exists(f"{file_path}.parquet"):
+                if os.path.exists(f"{file_path}.xlsx"):
+                    data = ei.read_excel(f"{file_path}.xlsx")
+                else:
+                    data1 = ei.read_excel(f"{file_path}_1.xlsx")
+                    data2 = ei.read_excel(f"{file_path}_2.xlsx")
                     data = pd.concat([data1, data2], axis=0)
-                    data.to_excel(file_path, index=False)
-        print(f"Finish {city}")
+                ei.write_parquet(data, f"{file_path}.parquet")
+    print(f"Finish {city}")
 
 
-def parse_transit_files():
+def merge_api_files():
     """
-    Parse the transit API files and extract relevant information.
+    Merge all API files for each city.
     """
-    for c in range(len(city_list)):
-        city = city_list[c]
-        if os.path.exists(f"./data/transit/{city}"):
-            print(f"Finish {city}")
-        else:
-            os.makedirs(f"./data/transit/{city}")
-            workplace_data = pd.read_excel(f"../data/workplace/{city}.xlsx")
-            for w in range(4):
-                code = workplace_data.loc[w, "code"]
-                api_data_original = pd.read_excel(
-                    f"./data/api/api_transit/{city}/{city}_transit_{code}.xlsx"
-                )
-                api_data = api_data_original[api_data_original["commuting time/m"] != 0]
-
-                route_info = api_data["route"].tolist()
-                invalid_indices = []
-                for index, route in enumerate(route_info):
-                    if not is_valid_for_literal_eval(route):
-                        invalid_indices.append(index)
-
-                df_cleaned = api_data.drop(index=api_data.index[invalid_indices])
-                api_data = df_cleaned
-                route_info = api_data["route"].tolist()
-
-                walking_time = []
-                walking_distance = []
-                transit_time = []
-                transit_distance = []
-                transit_price = []
-                commuting_mode = []
-
-                for route in tqdm(route_info):
-                    list_route = ast.literal_eval(route)
-                    walking_time_1 = []
-                    walking_distance_1 = []
-                    transit_time_1 = []
-                    transit_distance_1 = []
-                    transit_price_1 = []
-                    commuting_mode_1 = []
-
-                    for each_route in list_route:
-                        mode = each_route.get("mode")
-                        if mode == "WALKING":
-                            commuting_mode_1.append(mode)
-                            walking_time_1.append(each_route.get("duration"))
-                            walking_distance_1.append(each_route.get("distance"))
-                        else:
-                            lines = each_route.get("lines")[0]
-                            commuting_mode_1.append(lines.get("vehicle"))
-                            transit_time_1.append(lines.get("duration"))
-                            transit_distance_1.append(lines.get("distance"))
-                            price = lines.get("price")
-                            if price == -1:
-                                transit_price_1.append(0)
-                            elif lines.get("vehicle") == "RAIL":
-                                transit_price_1.append(price * 100)
-                            else:
-                                transit_price_1.append(price)
-
-                    walking_time.append(sum(walking_time_1))
-                    walking_distance.append(sum(walking_distance_1) / 1000)
-                    transit_time.append(sum(transit_time_1))
-                    transit_distance.append(sum(transit_distance_1) / 1000)
-                    transit_price.append(sum(transit_price_1) / 100)
-                    commuting_mode.append(commuting_mode_1)
-
-                new_df = pd.DataFrame(
-                    {
-                        "commuting_mode": commuting_mode,
-                        "walking_time": walking_time,
-                        "walking_distance": walking_distance,
-                        "transit_price": transit_price,
-                        "transit_time": transit_time,
-                        "transit_distance": transit_distance,
-                    }
-                )
-
-                del api_data[api_data.columns[-1]]
-                api_data.to_excel(
-                    f"./data/transit/{city}/{city}_{code}.xlsx", index=False
-                )
-                old_df = pd.read_excel(f"./data/transit/{city}/{city}_{code}.xlsx")
-                final_df = pd.concat([old_df, new_df], axis=1)
-                final_df.to_excel(
-                    f"./data/transit/{city}/{city}_{code}.xlsx", index=False
-                )
-            print(f"Complete the parsing of {city} trainsit")
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(merge_city_api_files, city_list))
 
 
-def merge_driving_and_transit_files():
+def parse_city_transit_files(city):
     """
-    Merge driving and transit API files for each city.
+    Parse the transit API files of one city and extract relevant information.
+
+    :param city: City name
     """
-    for c in range(len(city_list)):
-        city = city_list[c]
-        if not os.path.exists(f"./data/driving+transit/{city}"):
-            os.makedirs(f"./data/driving+transit/{city}")
-        workplace_data = pd.read_excel(f"../data/workplace/{city}.xlsx")
-        for w in range(4):
-            point_work = workplace_data.loc[w, "lat":"lng"]
-            code = workplace_data.loc[w, "code"]
-
-            api_transit_data = pd.read_excel(
-                f"./data/transit/{city}/{city}_{code}.xlsx"
-            )
-            api_transit_data["individual_rent_price"] = (
-                api_transit_data["价格(元/月）"] / api_transit_data["室/房间"]
+    if os.path.exists(f"./data/transit/{city}"):
+        print(f"Finish {city}")
+    else:
+        os.makedirs(f"./data/transit/{city}")
+        workplace_data = pd.read_parquet(f"../data/workplace/{city}.parquet")
+        for code in workplace_data["code"].head(4):
+            api_data_original = pd.read_parquet(
+                f"./data/api/api_transit/{city}/{city}_transit_{code}.parquet"
             )
-            api_transit_data["commuting_distance"] = (
-                api_transit_data["commuting distance/min"] / 1000
+            api_data = api_data_original[api_data_original["commuting time/m"] != 0]
+
+            # Parse every route once, dropping the rows whose route cannot be parsed
+            list_routes = []
+            invalid_indices = []
+            fallback_number = 0
+            for index, route in enumerate(api_data["route"].tolist()):
+                try:
+                    list_route, used_fallback = parse_route(route)
+                except (ValueError, SyntaxError, TypeError):
+                    invalid_indices.append(index)
+                    continue
+                list_routes.append(list_route)
+                fallback_number += used_fallback
+            api_data = api_data.drop(index=api_data.index[invalid_indices])
+            print(
+                f"{city} {code}: {fallback_number}/{len(list_routes)} routes "
+                "needed the literal_eval fallback"
             )
-            api_transit_data = api_transit_data.rename(
-                columns={
-                    "commuting distance": "commuting_distance",
-                    "commuting time": "commuting_time",
+
+            route_number = len(list_routes)
+            walking_time = np.empty(route_number, dtype=np.float64)
+            walking_distance = np.empty(route_number, dtype=np.float64)
+            transit_time = np.empty(route_number, dtype=np.float64)
+            transit_distance = np.empty(route_number, dtype=np.float64)
+            transit_price = np.empty(route_number, dtype=np.float64)
+            commuting_mode = []
+
+            for r, list_route in enumerate(tqdm(list_routes)):
+                walking_time_1 = 0
+                walking_distance_1 = 0
+                transit_time_1 = 0
+                transit_distance_1 = 0
+                transit_price_1 = 0
+                commuting_mode_1 = []
+
+                for each_route in list_route:
+                    mode = each_route.get("mode")
+                    if mode == "WALKING":
+                        commuting_mode_1.append(mode)
+                        walking_time_1 += each_route.get("duration")
+                        walking_distance_1 += each_route.get("distance")
+                    else:
+                        lines = each_route.get("lines")[0]
+                        vehicle = lines.get("vehicle")
+                        commuting_mode_1.append(vehicle)
+                        transit_time_1 += lines.get("duration")
+                        transit_distance_1 += lines.get("distance")
+                        price = lines.get("price")
+                        if price != -1:
+                            transit_price_1 += (
+                                price * 100 if vehicle == "RAIL" else price
+                            )
+
+                walking_time[r] = walking_time_1
+                walking_distance[r] = walking_distance_1 / 1000
+                transit_time[r] = transit_time_1
+                transit_distance[r] = transit_distance_1 / 1000
+                transit_price[r] = transit_price_1 / 100
+                commuting_mode.append(commuting_mode_1)
+
+            new_df = pd.DataFrame(
+                {
+                    "commuting_mode": commuting_mode,
+                    "walking_time": walking_time,
+                    "walking_distance": walking_distance,
+                    "transit_price": transit_price,
+                    "transit_time": transit_time,
+                    "transit_distance": transit_distance,
                 }
             )
 
-            api_driving_data = pd.read_excel(
-                f"./data/driving/{city}/{city}_{code}.xlsx"
-            )
-            api_driving_data = api_driving_data.drop(
-                columns=api_driving_data.columns[7:11], axis=1
-            )
-            api_driving_data = api_driving_data.drop(
-                columns=api_driving_data.columns[3:6], axis=1
-            )
+            api_data = api_data.drop(columns=api_data.columns[-1])
+            final_df = pd.concat([api_data.reset_index(drop=True), new_df], axis=1)
+            ei.write_parquet(final_df, f"./data/transit/{city}/{city}_{code}.parquet")
+        print(f"Complete the parsing of {city} trainsit")
 
-            all_data = api_transit_data.merge(
-                api_driving_data,
-                on=["标题", "价格(元/月）", "总面积(m^2/平方米）", "详细地址"],
-                how="left",
-            )
 
-            all_data.to_excel(
-                f"./data/driving+transit/{city}/{city}_{code}.xlsx", index=False
-            )
-        print(f"Complete the analysis of {city} driving and transit data")
+def parse_transit_files():
+    """
+    Parse the transit API files and extract relevant information.
+    """
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(parse_city_transit_files, city_list))
+
+
+def merge_city_driving_and_transit_files(city):
+    """
+    Merge driving and transit API files for one city.
+
+    :param city: City name
+    """
+    if not os.path.exists(f"./data/driving+transit/{city}"):
+        os.makedirs(f"./data/driving+transit/{city}")
+    workplace_data = pd.read_parquet(f"../data/workplace/{city}.parquet")
+    for code in workplace_data["code"].head(4):
+        api_transit_data = pd.read_parquet(
+            f"./data/transit/{city}/{city}_{code}.parquet"
+        )
+        api_transit_data["individual_rent_price"] = (
+            api_transit_data["价格(元/月）"] / api_transit_data["室/房间"]
+        )
+        api_transit_data["commuting_distance"] = (
+            api_transit_data["commuting distance/min"] / 1000
+        )
+        api_transit_data = api_transit_data.rename(
+            columns={
+                "commuting distance": "commuting_distance",
+                "commuting time": "commuting_time",
+            }
+        )
+
+        api_driving_data = pd.read_parquet(
+            f"./data/driving/{city}/{city}_{code}.parquet"
+        )
+        api_driving_data = api_driving_data.drop(
+            columns=api_driving_data.columns[7:11], axis=1
+        )
+        api_driving_data = api_driving_data.drop(
+            columns=api_driving_data.columns[3:6], axis=1
+        )
+
+        all_data = merge_on_factorized_keys(
+            api_transit_data,
+            api_driving_data,
+            ["标题", "价格(元/月）", "总面积(m^2/平方米）", "详细地址"],
+        )
+
+        ei.write_parquet(
+            all_data, f"./data/driving+transit/{city}/{city}_{code}.parquet"
+        )
+    print(f"Complete the analysis of {city} driving and transit data")
+
+
+def merge_driving_and_transit_files():
+    """
+    Merge driving and transit API files for each city.
+    """
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(executor.map(merge_city_driving_and_transit_files, city_list))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+Description:
+    This module is used to convert the Excel data files read repeatedly by the simulation into Parquet files once, before the simulation is run.
+"""
+
+import os
+
+import economic_indicators as ei
+
+# Constants
+DATA_DIRECTORIES = [
+    "../data/workplace",
+    "./data/rainfall",
+    "./data/driving+transit",
+]  # Directories whose Excel files are converted
+
+
+def convert_directory(directory):
+    """
+    Convert every Excel file under a directory into a Parquet file next to it, skipping the files already converted.
+
+    :param directory: Path of the directory
+    """
+    for root, _, file_names in os.walk(directory):
+        for file_name in file_names:
+            if not file_name.endswith(".xlsx"):
+                continue
+            file_path = os.path.join(root, file_name)
+            parquet_path = f"{file_path.removesuffix('.xlsx')}.parquet"
+            if not os.path.exists(parquet_path):
+                ei.write_parquet(ei.read_excel(file_path), parquet_path)
+        print(f"Finish {root}")
+
+
+if __name__ == "__main__":
+    for directory in DATA_DIRECTORIES:
+        convert_directory(directory)
@@ -4,10 +4,13 @@ Description:
     This module is used to calculate commuting costs in cities where commuting costs in driving mode are not available.
 """
 
+import functools
 import os
+from concurrent.futures import ProcessPoolExecutor
 
+import numpy as np
 import pandas as pd
-from statsmodels.formula.api import ols
+from scipy import stats
 
 import economic_indicators as ei
 
@@ -41,145 +44,178 @@ REGRESSION_SUMMARY_COLUMNS = [
 MIN_FARE = 10
 
 
-def save_regression_result_to_excel(result, filepath):
+def fare_regression_summary(distance, time, fare):
     """
-    Save regression results to an Excel file.
+    Fit the ordinary least squares fare model fare = b + k1 * distance + k2 * time and summarize the fit.
 
-    :param result: Regression result object
+    :param distance: Array of driving distances
+    :param time: Array of driving times
+    :param fare: Array of driving fares
 
-    :param filepath: Path to save the Excel file
+    :return: Dictionary of the regression statistics, keyed by REGRESSION_SUMMARY_COLUMNS
     """
+    data = np.column_stack([distance, time, fare]).astype(np.float64)
+    data = data[np.isfinite(data).all(axis=1)]  # Drop missing rows like statsmodels
+    y = data[:, 2]
+    x = np.column_stack([np.ones(len(data)), data[:, 0], data[:, 1]])
+    n, k = x.shape
+    df_model = k - 1
+    df_resid = n - k
+
+    params, *_ = np.linalg.lstsq(x, y, rcond=None)
+    residual = y - x @ params
+    ssr = residual @ residual
+    centered_tss = np.sum((y - y.mean()) ** 2)
+
+    bse = np.sqrt(np.diag(ssr / df_resid * np.linalg.inv(x.T @ x)))
+    tvalues = params / bse
+    pvalues = 2 * stats.t.sf(np.abs(tvalues), df_resid)
+    t_critical = stats.t.ppf(0.975, df_resid)
+    conf_lower = params - t_critical * bse
+    conf_upper = params + t_critical * bse
+
+    rsquared = 1 - ssr / centered_tss
+    rsquared_adj = 1 - (n - 1) / df_resid * (1 - rsquared)
+    fvalue = (rsquared / df_model) / ((1 - rsquared) / df_resid)
+    f_pvalue = stats.f.sf(fvalue, df_model, df_resid)
+
     regression_summary = {
-        "b": result.params[0],
-        "k1": result.params[1],
-        "k2": result.params[2],
-        "R-squared": result.rsquared,
-        "Adj. R-squared": result.rsquared_adj,
-        "F-statistic": result.fvalue,
-        "Prob (F-statistic)": result.f_pvalue,
-        "b-Std. Error": result.bse[0],
-        "b-t-statistic": result.tvalues[0],
-        "b-p-value": result.pvalues[0],
-        "b-95% CI Lower": result.conf_int().iloc[0, 0],
-        "b-95% CI Upper": result.conf_int().iloc[1, 0],
-        "k1-Std. Error": result.bse[1],
-        "k1-t-statistic": result.tvalues[1],
-        "k1-p-value": result.pvalues[1],
-        "k1-95% CI Lower": result.conf_int().iloc[0, 1],
-        "k1-95% CI Upper": result.conf_int().iloc[1, 1],
-        "k2-Std. Error": result.bse[2],
-        "k2-t-statistic": result.tvalues[2],
-        "k2-p-value": result.pvalues[2],
-        "k2-95% CI Lower": result.conf_int().iloc[0, 2],
-        "k2-95% CI Upper": result.conf_int().iloc[1, 2],
+        "b": params[0],
+        "k1": params[1],
+        "k2": params[2],
+        "R-squared": rsquared,
+        "Adj. R-squared": rsquared_adj,
+        "F-statistic": fvalue,
+        "Prob (F-statistic)": f_pvalue,
     }
+    for i, name in enumerate(["b", "k1", "k2"]):
+        regression_summary[f"{name}-Std. Error"] = bse[i]
+        regression_summary[f"{name}-t-statistic"] = tvalues[i]
+        regression_summary[f"{name}-p-value"] = pvalues[i]
+        regression_summary[f"{name}-95% CI Lower"] = conf_lower[i]
+        regression_summary[f"{name}-95% CI Upper"] = conf_upper[i]
+    return regression_summary
 
-    summary_df = pd.DataFrame(regression_summary, index=[0])
-    summary_df = summary_df.round(3)
-
-    with pd.ExcelWriter(filepath, engine="openpyxl", mode="w") as writer:
-        summary_df.to_excel(writer, sheet_name="Regression Summary", index=False)
-
-    print(f"Regression results saved to {filepath}")
 
+def fit_city_fare_model(city):
+    """
+    Normalize the driving API files of one city and fit its fare model when taxi fares are available.
 
-def main():
-    city_list = ei.get_city()
+    :param city: City name
 
-    have_fare_city = []
-    no_fare_city = []
+    :return: The regression summary of the city, or None if the city has no taxi fares
+    """
+    city_dir = f"./data/driving/{city}"
+    if not os.path.exists(city_dir):
+        os.makedirs(city_dir)
 
-    for city in city_list:
-        city_dir = f"./data/driving/{city}"
-        if not os.path.exists(city_dir):
-            os.makedirs(city_dir)
+    workplace_data = pd.read_parquet(f"../data/workplace/{city}.parquet")
+    all_data = []
 
-        workplace_data = pd.read_excel(f"../data/workplace/{city}.xlsx")
-        all_data = []
+    for code in workplace_data["code"].head(4):
+        api_data = pd.read_parquet(
+            f"./data/api/api_driving/{city}/{city}_driving_{code}.parquet"
+        )
 
-        for w in range(4):
-            point_work = workplace_data.loc[w, "lat":"lng"]
-            code = workplace_data.loc[w, "code"]
-            api_data = pd.read_excel(
-                f"./data/api/api_driving/{city}/{city}_driving_{code}.xlsx"
+        if "commuting distance/min" in api_data.columns:
+            api_data["commuting distance/min"] = (
+                api_data["commuting distance/min"] / 1000
             )
+            api_data = api_data.rename(
+                columns={
+                    "commuting distance/min": "driving_distance/km",
+                    "commuting time/m": "driving_time/min",
+                    "fare": "driving_fare",
+                }
+            )
+            ei.write_parquet(api_data, f"./data/driving/{city}/{city}_{code}.parquet")
 
-            if "commuting distance/min" in api_data.columns:
-                api_data["commuting distance/min"] = (
-                    api_data["commuting distance/min"] / 1000
-                )
-                api_data = api_data.rename(
-                    columns={
-                        "commuting distance/min": "driving_distance/km",
-                        "commuting time/m": "driving_time/min",
-                        "fare": "driving_fare",
-                    }
-                )
-                api_data.to_excel(
-                    f"./data/driving/{city}/{city}_{code}.xlsx", index=False
-                )
-
-            fare = api_data["driving_fare"].tolist()
-            if fare[0] == 0:
-                break
-            else:
-                if not all_data:
-                    all_data = api_data
-                else:
-                    all_data = pd.concat([all_data, api_data], axis=0)
-
+        fare = api_data["driving_fare"].tolist()
         if fare[0] == 0:
-            no_fare_city.append(city)
             print(f"{city} cannot get taxi fare")
-        else:
-            have_fare_city.append(city)
-            new_df = all_data[
-                ["driving_distance/km", "driving_time/min", "driving_fare"]
-            ]
-            new_df.columns = ["a", "b", "c"]
-
-            model_formula = "c ~ a + b"
-            model = ols(model_formula, data=new_df)
-            result = model.fit()
-            save_regression_result_to_excel(
-                result, f"./data/faremodel/{city}-regression_summary.xlsx"
-            )
-            print(f"Finished {city}")
+            return None
+        all_data.append(api_data)
+
+    all_data = pd.concat(all_data, axis=0, ignore_index=True)
+    regression_summary = fare_regression_summary(
+        all_data["driving_distance/km"].to_numpy(),
+        all_data["driving_time/min"].to_numpy(),
+        all_data["driving_fare"].to_numpy(),
+    )
+    print(f"Finished {city}")
+    return {"city": city, **regression_summary}
 
-    results = pd.DataFrame()
 
-    for city in have_fare_city:
-        city_df = pd.read_excel(f"./data/faremodel/{city}-regression_summary.xlsx")
-        city_df = city_df.assign(city=city).reindex(
-            columns=["city"] + REGRESSION_SUMMARY_COLUMNS
+def apply_fare_model(city, b, k1, k2):
+    """
+    Estimate the driving fares of a city without taxi fares from the average fare model.
+
+    :param city: City name
+    :param b: Intercept of the fare model
+    :param k1: Distance coefficient of the fare model
+    :param k2: Time coefficient of the fare model
+    """
+    workplace_data = pd.read_parquet(f"../data/workplace/{city}.parquet")
+    codes = workplace_data["code"].head(4).tolist()
+
+    # Stack the workplaces' driving files so the fares are computed in one pass
+    api_data = pd.concat(
+        [
+            pd.read_parquet(f"./data/driving/{city}/{city}_{code}.parquet")
+            for code in codes
+        ],
+        keys=codes,
+    )
+    api_data["driving_distance/km"] = api_data["driving_distance/km"] / 1000
+    # A missing distance or time fails the integer cast instead of yielding a fare
+    api_data["driving_fare"] = (
+        (k1 * api_data["driving_distance/km"] + k2 * api_data["driving_time/min"] + b)
+        .clip(lower=MIN_FARE)
+        .astype(int)
+    )
+
+    for code, code_data in api_data.groupby(level=0, sort=False):
+        ei.write_parquet(
+            code_data.droplevel(0), f"./data/driving/{city}/{city}_{code}.parquet"
         )
-        results = pd.concat([results, city_df], axis=0)
 
-    results.to_excel(f"./data/faremodel/all-regression_summary.xlsx", index=False)
+    print(f"Finished {city} fare calculation")
+
+
+def main():
+    city_list = ei.get_city()
+
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        city_summaries = list(executor.map(fit_city_fare_model, city_list))
+
+    no_fare_city = [
+        city for city, summary in zip(city_list, city_summaries) if summary is None
+    ]
+    regression_summaries = [
+        summary for summary in city_summaries if summary is not None
+    ]
+
+    results = pd.DataFrame(
+        regression_summaries, columns=["city"] + REGRESSION_SUMMARY_COLUMNS
+    ).round(3)
+    with pd.ExcelWriter(
+        "./data/faremodel/all-regression_summary.xlsx",
+        engine="xlsxwriter",
+        engine_kwargs={"options": {"constant_memory": True}},
+    ) as writer:
+        results.to_excel(writer, sheet_name="Regression Summary", index=False)
+    print("Regression results saved to ./data/faremodel/all-regression_summary.xlsx")
 
     b = results["b"].mean()
     k1 = results["k1"].mean()
     k2 = results["k2"].mean()
 
-    for city in no_fare_city:
-        workplace_data = pd.read_excel(f"../data/workplace/{city}.xlsx")
-
-        for w in range(4):
-            code = workplace_data.loc[w, "code"]
-            api_data = pd.read_excel(f"./data/driving/{city}/{city}_{code}.xlsx")
-            api_data["driving_distance/km"] = api_data["driving_distance/km"] / 1000
-            api_data["driving_fare"] = api_data.apply(
-                lambda row: k1 * row["driving_distance/km"]
-                + k2 * row["driving_time/min"]
-                + b,
-                axis=1,
-            )
-            api_data["driving_fare"] = (
-                api_data["driving_fare"].clip(lower=MIN_FARE).astype(int)
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        list(
+            executor.map(
+                functools.partial(apply_fare_model, b=b, k1=k1, k2=k2), no_fare_city
             )
-            api_data.to_excel(f"./data/driving/{city}/{city}_{code}.xlsx", index=False)
-
-        print(f"Finished {city} fare calculation")
+        )
 
 
 if __name__ == "__main__":
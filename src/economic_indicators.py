@@ -4,12 +4,13 @@ Description:
     This module is used to obtain and process economic indicators related to cities.
 """
 
+import functools
 import os
-import random
 import math
 
 import numpy as np
 import pandas as pd
+from numba import float64, vectorize
 
 # Constants
 COUNTRY_INCOME = 36883  # National average income (CNY)
@@ -17,6 +18,7 @@ INCOME_GROUP = [8601, 19303, 30598, 47397, 90116]  # Income groups
 URBAN_PEOPLE = 897.578  # Urban population (million)
 RURAL_PEOPLE = 514.597  # Rural population (million)
 INCOME_MULTIPLE = 2.45  # Urban-rural income difference multiple (2022)
+RNG = np.random.default_rng()  # Random generator shared by the simulation
 
 
 def city_income(city):
@@ -30,33 +32,32 @@ def city_income(city):
     urban_income = ((URBAN_PEOPLE + RURAL_PEOPLE) * COUNTRY_INCOME) / (
         URBAN_PEOPLE + RURAL_PEOPLE * (1 / INCOME_MULTIPLE)
     )
-    adjusted_income_group = [(urban_income / COUNTRY_INCOME) * i for i in INCOME_GROUP]
+    adjusted_income_group = np.array(INCOME_GROUP) * (urban_income / COUNTRY_INCOME)
 
     df = get_data()
-    income_list = df["average_income"].tolist()
-    income_city = income_list[city_index(city)]
+    income_city = df.at[city, "average_income"]
+    min_consumption_city = df.at[city, "min_c/month"]
+
+    average_income_perincomegroup = (
+        income_city / COUNTRY_INCOME * adjusted_income_group
+    ).astype(int)
+    tran = np.concatenate(
+        (
+            [min_consumption_city],
+            average_income_perincomegroup,
+            [2 * average_income_perincomegroup[-1]],
+        )
+    )
 
-    average_income_perincomegroup = [
-        int(income_city / COUNTRY_INCOME * i) for i in adjusted_income_group
-    ]
-    tran = [int(income_city / COUNTRY_INCOME * i) for i in adjusted_income_group]
-    tran.insert(0, city_min_consumption(city))
-    tran.append(2 * tran[-1])
-
-    income_range_perincomegroup = []
-    for i in range(len(tran) - 2):
-        if i == 0:
-            lower_limit = min(
-                city_min_consumption(city) * 12, average_income_perincomegroup[i] / 1.2
-            )
-        else:
-            lower_limit = (tran[i] + tran[i + 1]) / 2
-        upper_limit = (tran[i + 1] + tran[i + 2]) / 2
-        income_range_perincomegroup.append([lower_limit, upper_limit])
+    # Each income group ranges between the midpoints with its neighbouring groups
+    lower_limit = (tran[:-2] + tran[1:-1]) / 2
+    lower_limit[0] = min(
+        min_consumption_city * 12, average_income_perincomegroup[0] / 1.2
+    )
+    upper_limit = (tran[1:-1] + tran[2:]) / 2
+    income_range_perincomegroup = np.column_stack((lower_limit, upper_limit))
 
-    disposable_income_permonth = [
-        int((1 / 12) * p) for p in average_income_perincomegroup
-    ]
+    disposable_income_permonth = ((1 / 12) * average_income_perincomegroup).astype(int)
 
     return (
         income_city,
@@ -67,20 +68,6 @@ def city_income(city):
     )
 
 
-def city_index(city):
-    """
-    Get the index of the city in the list of cities.
-
-    :param city: City name
-
-    :return: Index of the city in the list of cities
-    """
-    df = get_data()
-    city_list = df["city"].tolist()
-    index = city_list.index(city)
-    return index
-
-
 def city_min_consumption(city):
     """
     Get the minimum consumption for residents of a specific city.
@@ -90,8 +77,7 @@ def city_min_consumption(city):
     :return: The minimum consumption for residents of the city
     """
     df = get_data()
-    min_c_list = df["min_c/month"].tolist()
-    min_c_city = min_c_list[city_index(city)]
+    min_c_city = df.at[city, "min_c/month"]
     return min_c_city
 
 
@@ -104,8 +90,7 @@ def city_rent_income_ratio(city):
     :return: The rent income ratio of the city
     """
     df = get_data()
-    rent_income_ratio_list = df["rent_income_ratio"].tolist()
-    rent_income_ratio_city = rent_income_ratio_list[city_index(city)]
+    rent_income_ratio_city = df.at[city, "rent_income_ratio"]
     # Set increment by income group
     increment = -0.01
     each_income_group_rent_income_ratio = np.arange(
@@ -116,17 +101,18 @@ def city_rent_income_ratio(city):
     return each_income_group_rent_income_ratio
 
 
+@functools.lru_cache(maxsize=1)
 def get_city():
     """
-    Get a list of all city names.
+    Get a list of all city names. The rainfall directory is listed only once per process.
 
     :return: A list of all city names
     """
-    a = os.listdir("../data/rainfall")
-    city = []
-    for i in a:
-        city1 = os.path.splitext(i)[0]
-        city.append(city1)
+    city = [
+        name.removesuffix(".xlsx")
+        for name in os.listdir("../data/rainfall")
+        if name.endswith(".xlsx")
+    ]
     return city
 
 
@@ -147,10 +133,10 @@ def get_consumption(
     :param income_perday: Daily income of the residents
     :param extra_consumption_perday: Additional consumption of residents, including food, clothing, housing, and transportation, etc
     :param average_saving_ratio: Average savings to income ratio
-    :param commuting_consumption: Consumption during commuting under rainfall
-    :param income_loss: Income loss due to increased commuting time
+    :param commuting_consumption: Consumption during commuting under rainfall, a value or an array with one value per day
+    :param income_loss: Income loss due to increased commuting time, a value or an array with one value per day
 
-    :return: The disposable consumption and asset loss of residents
+    :return: The disposable consumption and asset loss of residents, with the same shape as the commuting inputs
     """
     disposable_consumption_today = (
         max(
@@ -164,35 +150,34 @@ def get_consumption(
     return disposable_consumption_today, asset_loss_today
 
 
+@functools.lru_cache(maxsize=1)
 def get_data():
     """
-    Get the dataframe that holds the city information.
+    Get the dataframe that holds the city information, indexed by city name. The file is read only once per process.
 
     :return: The dataframe that holds the city information
     """
-    df = pd.read_excel("../data/city.xlsx")
+    df = read_excel("../data/city.xlsx").set_index("city")
     return df
 
 
-def get_housing_group(df, rent_range_peryear):
+def get_housing_slice(prices, rent_range_peryear):
     """
-    Obtain the corresponding road network simulation information according to the working place name, and determine the housing that residents can live in.
+    Locate the listings whose individual rent lies strictly inside the annual rent range, by binary search over the sorted rent prices.
 
-    :param df: Rental listing dataframe
+    :param prices: Sorted individual rent prices of the listings, as returned by sort_housing_by_rent
     :param rent_range_peryear: Rental property annual rent range
 
-    :return: The housing available to the resident
+    :return: Slice of the positions of the available listings in the sorted listings
     """
-    group = df[
-        (df["individual_rent_price"] < rent_range_peryear[1] / 12)
-        & (df["individual_rent_price"] > rent_range_peryear[0] / 12)
-    ]
-    return group
+    lower_index = np.searchsorted(prices, rent_range_peryear[0] / 12, side="right")
+    upper_index = np.searchsorted(prices, rent_range_peryear[1] / 12, side="left")
+    return slice(int(lower_index), int(upper_index))
 
 
 def get_individual_income(income):
     """
-    Calculate individual income indicators.
+    Calculate individual income indicators. The income may also be an array with one value per resident.
 
     :param income: Annual income
 
@@ -204,6 +189,51 @@ def get_individual_income(income):
     return income_permonth, income_perday, income_perhour
 
 
+def get_nonempty_housing_slice(
+    prices, income, rent_income_ratio_range, ratio_step=0.05
+):
+    """
+    Locate the listings available to a resident, widening the rent-income ratio range by the step on both sides until it holds at least one listing. The number of steps is derived from the nearest rents outside the range rather than by retrying.
+
+    :param prices: Sorted individual rent prices of the listings, as returned by sort_housing_by_rent
+    :param income: Annual income of the resident
+    :param rent_income_ratio_range: Rent-income ratio range of the resident
+    :param ratio_step: Rent-income ratio added to each side of the range per step
+
+    :return: Slice of the positions of the available listings in the sorted listings
+    """
+    if len(prices) == 0:
+        raise ValueError("no rental listings to choose from")
+
+    lower_ratio, upper_ratio = rent_income_ratio_range
+    housing_slice = get_housing_slice(
+        prices, [income * lower_ratio, income * upper_ratio]
+    )
+    steps = 0
+    if housing_slice.start >= housing_slice.stop:
+        # Every rent lies outside the range, so the closest rent on either side
+        # determines how many steps are needed for it to fall inside
+        rent_step = income * ratio_step / 12
+        candidate_steps = []
+        if housing_slice.start > 0:
+            gap = income * lower_ratio / 12 - prices[housing_slice.start - 1]
+            candidate_steps.append(gap // rent_step + 1)
+        if housing_slice.stop < len(prices):
+            gap = prices[housing_slice.stop] - income * upper_ratio / 12
+            candidate_steps.append(gap // rent_step + 1)
+        steps = int(min(candidate_steps))
+
+    # Safety guard for rounding that leaves the closest rent on the range boundary
+    while housing_slice.start >= housing_slice.stop:
+        rent_range = [
+            income * (lower_ratio - ratio_step * steps),
+            income * (upper_ratio + ratio_step * steps),
+        ]
+        housing_slice = get_housing_slice(prices, rent_range)
+        steps += 1
+    return housing_slice
+
+
 def get_people_income_list(income_range, average_income, people_number):
     """
     According to the average income and the number of people in this income class, output the simulated income distribution list.
@@ -214,34 +244,77 @@ def get_people_income_list(income_range, average_income, people_number):
 
     :return: The specific value of income per resident obtained by simulation
     """
-    people_average_income = 0
+    low_income = RNG.integers(
+        int(income_range[0]), int(average_income), size=people_number, endpoint=True
+    ).tolist()
+    high_income = RNG.integers(
+        int(average_income), int(income_range[1]), size=people_number, endpoint=True
+    ).tolist()
+
+    # Draw below the average whenever the running average of the draws is above it
     people_income_list = []
-    for _ in range(people_number):
-        if people_average_income > average_income:
-            people_income_list.append(
-                random.randint(int(income_range[0]), int(average_income))
-            )
+    income_total = 0
+    for p in range(people_number):
+        if income_total > average_income * p:
+            income = low_income[p]
         else:
-            people_income_list.append(
-                random.randint(int(average_income), int(income_range[1]))
-            )
-        people_average_income = sum(people_income_list) / len(people_income_list)
+            income = high_income[p]
+        people_income_list.append(income)
+        income_total += income
     return people_income_list
 
 
-def get_wellbeing(disposable_asset_today, disposable_asset_today_ideally, theta):
+@vectorize([float64(float64, float64, float64)], cache=True)
+def get_wellbeing_loss(disposable_asset_today, disposable_asset_today_ideally, theta):
     """
-    Calculate wellbeing.
+    Calculate the well-being loss as a compiled ufunc, so a whole array of days is evaluated in one call.
 
     :param disposable_asset_today: The remaining disposable property of residents today
     :param disposable_asset_today_ideally: The remaining disposable property of residents today without rain
     :param theta: Model coefficient
 
-    :return: Well-being value and well-being loss value
+    :return: Well-being loss value
     """
     utility = (disposable_asset_today ** (1 - theta)) / (1 - theta)
-    well_being_increment = utility * math.exp(-0.1)
     utility_ideally = (disposable_asset_today_ideally ** (1 - theta)) / (1 - theta)
-    well_being_increment_ideally = utility_ideally * math.exp(-0.1)
-    wellbeing_loss = well_being_increment_ideally - well_being_increment
-    return well_being_increment, wellbeing_loss
+    wellbeing_loss = (utility_ideally - utility) * math.exp(-0.1)
+    return wellbeing_loss
+
+
+def read_excel(file_path):
+    """
+    Read an Excel file with the calamine engine, which parses much faster than the default openpyxl engine.
+
+    :param file_path: Path of the Excel file
+
+    :return: The dataframe read from the Excel file
+    """
+    df = pd.read_excel(file_path, engine="calamine")
+    return df
+
+
+def sort_housing_by_rent(df):
+    """
+    Sort the rental listings by individual rent once, so that get_housing_slice can select a rent range by binary search.
+
+    :param df: Rental listing dataframe
+
+    :return: The listings without a rent price dropped and sorted by individual rent, and the sorted rent prices
+    """
+    df_sorted = (
+        df.dropna(subset=["individual_rent_price"])
+        .sort_values("individual_rent_price", kind="stable")
+        .reset_index(drop=True)
+    )
+    prices = df_sorted["individual_rent_price"].to_numpy()
+    return df_sorted, prices
+
+
+def write_parquet(df, file_path):
+    """
+    Write an intermediate dataframe to a zstd-compressed Parquet file, which is much faster to write and read than Excel.
+
+    :param df: The dataframe to write
+    :param file_path: Path of the Parquet file
+    """
+    df.to_parquet(file_path, index=False, compression="zstd")
@@ -4,9 +4,7 @@ Description:
     This module is used to process rainfall data during the weekday commuting period in 2022 and construct a vehicle speed attenuation model under rainfall conditions. It includes functions for reading and processing rainfall data, as well as calculating the impact of rainfall on vehicle speeds.
 """
 
-import math
-
-import pandas as pd
+import numpy as np
 
 import economic_indicators as ei
 
@@ -26,10 +24,9 @@ def get_city_rainfall_24hour(city):
     :return: Rainfall data for selected cities after processing
     """
     df = get_original_rainfall(city)
-    rainfall = df["rain_final"].tolist()
-    rainfall_process = [
-        round(2 * x, 3) for x in rainfall
-    ]  # Rainfall is converted to mm/h
+    rainfall = df["rain_final"].to_numpy(dtype=np.float64)
+    # Rainfall is converted to mm/h
+    rainfall_process = np.round(RAINFALL_CONVERSION_FACTOR * rainfall, 3).tolist()
     return rainfall_process
 
 
@@ -41,7 +38,7 @@ def get_original_rainfall(city):
 
     :return: Rainfall dataframe of the city
     """
-    df = pd.read_excel(f"../data/rainfall/{city}.xlsx")
+    df = ei.read_excel(f"../data/rainfall/{city}.xlsx")
     return df
 
 
@@ -53,15 +50,12 @@ def rainfall_model(rainfall_list):
 
     :return: List of percentage of speed decay per day
     """
-    velocity_attenuation_percentage = []
-    for rainfall in rainfall_list:
-        if rainfall == 0:
-            velocity_attenuation_percentage.append(1)
-        else:
-            depth = WATER_DEPTH_COEFFICIENT * 0.75 * rainfall / 1000
-            v = MAX_VEHICLE_SPEED * math.exp((-9) * depth)
-            velocity_attenuation_percentage.append(v)
-    return velocity_attenuation_percentage
+    rainfall = np.asarray(rainfall_list, dtype=np.float64)
+    depth = WATER_DEPTH_COEFFICIENT * 0.75 * rainfall / 1000
+    velocity_attenuation_percentage = np.where(
+        rainfall == 0, 1, MAX_VEHICLE_SPEED * np.exp((-9) * depth)
+    )
+    return velocity_attenuation_percentage.tolist()
 
 
 if __name__ == "__main__":
@@ -71,4 +65,4 @@ if __name__ == "__main__":
         velocity_attenuation = rainfall_model(rainfall_list)
         df = get_original_rainfall(city)
         df["velocity_change"] = velocity_attenuation
-        df.to_excel(f"./data/rainfall/{city}.xlsx")
+        ei.write_parquet(df, f"./data/rainfall/{city}.parquet")
@@ -4,8 +4,29 @@ Description:
     This module is used to invoke Tencent map api to obtain location coordinates and path information.
 """
 
+import asyncio
+import itertools
+
+import aiohttp
 import requests
-from pprint import pprint
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Constants
+DIRECTION_URL = "https://apis.map.qq.com/ws/direction/v1/{mode}/"
+REQUEST_TIMEOUT = (3, 10)  # Connect and read timeouts (s)
+MAX_CONCURRENT_REQUESTS = 50  # Maximum number of asynchronous requests in flight
+
+# Shared session, so that repeated API calls reuse pooled connections
+SESSION = requests.Session()
+SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        pool_connections=32,
+        pool_maxsize=64,
+        max_retries=Retry(total=3, backoff_factor=0.2),
+    ),
+)
 
 
 def get_coordinates(city, address):
@@ -17,15 +38,18 @@ def get_coordinates(city, address):
 
     :return: The latitude and longitude coordinates of the specified location
     """
-    response = requests.get(
-        url="https://apis.map.qq.com/ws/geocoder/v1/",
+    response = SESSION.get(
+        "https://apis.map.qq.com/ws/geocoder/v1/",
         params={
             "region": city,
             "address": address,
             "key": "YOUR_API_KEY",  # Replace with your actual API key
         },
+        timeout=REQUEST_TIMEOUT,
     ).json()
-    pprint(response)
+
+    location = response.get("result", {}).get("location", {})
+    return location.get("lat"), location.get("lng")
 
 
 def get_driving_directions(
@@ -45,22 +69,18 @@ def get_driving_directions(
     start_point = f"{start_latitude},{start_longitude}"
     end_point = f"{end_latitude},{end_longitude}"
     keys = ["YOUR_API_KEY"]  # Replace with your actual API keys
-    response = requests.get(
-        url="https://apis.map.qq.com/ws/direction/v1/driving/",
+    response = SESSION.get(
+        DIRECTION_URL.format(mode="driving"),
         params={
             "key": keys[key_index],
             "from": start_point,
             "to": end_point,
             "policy": "LEAST_TIME",
         },
+        timeout=REQUEST_TIMEOUT,
     ).json()
 
-    route = response.get("result", {}).get("routes", [{}])[0]
-    return (
-        route.get("distance"),
-        route.get("duration"),
-        route.get("taxi_fare", {}).get("fare"),
-    )
+    return parse_driving_response(response)
 
 
 def get_transit_directions(
@@ -80,16 +100,117 @@ def get_transit_directions(
     start_point = f"{start_latitude},{start_longitude}"
     end_point = f"{end_latitude},{end_longitude}"
     keys = ["YOUR_API_KEY"]  # Replace with your actual API keys
-    response = requests.get(
-        url="https://apis.map.qq.com/ws/direction/v1/transit/",
+    response = SESSION.get(
+        DIRECTION_URL.format(mode="transit"),
         params={
             "key": keys[key_index],
             "from": start_point,
             "to": end_point,
             "policy": "LEAST_TIME",
         },
+        timeout=REQUEST_TIMEOUT,
     ).json()
 
+    return parse_transit_response(response)
+
+
+async def aget_directions(
+    session, mode, start_latitude, start_longitude, end_latitude, end_longitude, key
+):
+    """
+    Asynchronously get travel information from start to finish.
+
+    :param session: The aiohttp client session used to send the request.
+    :param mode: Travel mode, either "driving" or "transit".
+    :param start_latitude: Latitude of the starting point.
+    :param start_longitude: Longitude of the starting point.
+    :param end_latitude: Latitude of the ending point.
+    :param end_longitude: Longitude of the ending point.
+    :param key: The API key to use.
+
+    :return: Minimum path time, corresponding length, and related information.
+    """
+    async with session.get(
+        DIRECTION_URL.format(mode=mode),
+        params={
+            "key": key,
+            "from": f"{start_latitude},{start_longitude}",
+            "to": f"{end_latitude},{end_longitude}",
+            "policy": "LEAST_TIME",
+        },
+    ) as response:
+        response = await response.json(content_type=None)
+
+    if mode == "driving":
+        return parse_driving_response(response)
+    return parse_transit_response(response)
+
+
+async def aget_directions_batch(points, keys, mode):
+    """
+    Asynchronously get travel information for many start and end points, with at most MAX_CONCURRENT_REQUESTS
+    requests in flight and the API keys used in rotation.
+
+    :param points: List of (start_latitude, start_longitude, end_latitude, end_longitude) tuples.
+    :param keys: List of API keys.
+    :param mode: Travel mode, either "driving" or "transit".
+
+    :return: List of results in the order of the points, with the exception raised for each failed request.
+    """
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    timeout = aiohttp.ClientTimeout(
+        sock_connect=REQUEST_TIMEOUT[0], sock_read=REQUEST_TIMEOUT[1]
+    )
+
+    async def limited(session, point, key):
+        async with semaphore:
+            return await aget_directions(session, mode, *point, key)
+
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        tasks = [
+            limited(session, point, key)
+            for point, key in zip(points, itertools.cycle(keys))
+        ]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def get_directions_batch(points, keys, mode):
+    """
+    Get travel information for many start and end points concurrently.
+
+    :param points: List of (start_latitude, start_longitude, end_latitude, end_longitude) tuples.
+    :param keys: List of API keys.
+    :param mode: Travel mode, either "driving" or "transit".
+
+    :return: List of results in the order of the points, with the exception raised for each failed request.
+    """
+    return asyncio.run(aget_directions_batch(points, keys, mode))
+
+
+def parse_driving_response(response):
+    """
+    Extract the route information from a driving direction response.
+
+    :param response: The decoded JSON response.
+
+    :return: Minimum path length, corresponding time, and taxi fare.
+    """
+    route = response.get("result", {}).get("routes", [{}])[0]
+    return (
+        route.get("distance"),
+        route.get("duration"),
+        route.get("taxi_fare", {}).get("fare"),
+    )
+
+
+def parse_transit_response(response):
+    """
+    Extract the route information from a transit direction response.
+
+    :param response: The decoded JSON response.
+
+    :return: Minimum path length, corresponding time, and route steps.
+    """
     if response.get("status") == 0:
         route = response.get("result", {}).get("routes", [{}])[0]
         return (route.get("distance"), route.get("duration"), route.get("steps"))
@@ -5,13 +5,24 @@ Description:
 """
 
 import os
-import random
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from multiprocessing import shared_memory
 
+import numpy as np
 import pandas as pd
+from numba import njit
 from tqdm import tqdm
 
 import economic_indicators as ei
 
+# Constants
+PEOPLE_BATCH_SIZE = 64  # Residents simulated between updates of the rent range target
+SharedArray = namedtuple("SharedArray", ["name", "dtype", "shape"])  # Shared block
+
+# Shared memory blocks attached by this worker process, kept open until it exits
+attached_blocks = {}
+
 
 def probability_normalize(
     distance_list, time_list, rent_list, weight1, weight2, weight3
@@ -28,23 +39,20 @@ def probability_normalize(
     :param weight2: The weight of the time factor
     :param weight3: The weight of the rent factor
 
-    :return: The probability of selecting each rental property
+    :return: Array of the probability of selecting each rental property
     """
-    distance_total = sum([1 / x for x in distance_list])
-    distance_chance = [(1 / x) / distance_total for x in distance_list]
+    distance_chance = 1 / np.asarray(distance_list, dtype=np.float64)
+    distance_chance /= distance_chance.sum()
 
-    time_total = sum([1 / x for x in time_list])
-    time_chance = [(1 / x) / time_total for x in time_list]
+    time_chance = 1 / np.asarray(time_list, dtype=np.float64)
+    time_chance /= time_chance.sum()
 
-    rent_total = sum([1 / x for x in rent_list])
-    rent_chance = [(1 / x) / rent_total for x in rent_list]
+    rent_chance = 1 / np.asarray(rent_list, dtype=np.float64)
+    rent_chance /= rent_chance.sum()
 
-    final_chance = [
-        distance_chance[i] * weight1
-        + time_chance[i] * weight2
-        + rent_chance[i] * weight3
-        for i in range(len(distance_chance))
-    ]
+    final_chance = (
+        distance_chance * weight1 + time_chance * weight2 + rent_chance * weight3
+    )
     return final_chance
 
 
@@ -58,18 +66,23 @@ def get_city_data(city):
     min_consumption = ei.city_min_consumption(city) / 30
     rent_income_ratio = ei.city_rent_income_ratio(city)
     income_list = ei.city_income(city)
-    average_income = income_list[0]
-    income_range = income_list[1]
-    monthly_disposable_income = income_list[2]
-
-    rainfall_df = pd.read_excel(f"./data/rainfall/{city}.xlsx")
-    velocity_attenuation_percentage_list = rainfall_df["velocity_change"].tolist()
+    average_income = income_list[1]  # Average income of each income group
+    income_range = income_list[3]
+    monthly_disposable_income = income_list[4]
+
+    rainfall_df = pd.read_parquet(f"./data/rainfall/{city}.parquet")
+    velocity_attenuation = rainfall_df["velocity_change"].to_numpy(dtype=np.float64)
+    if not np.isfinite(velocity_attenuation).all():
+        raise ValueError(f"Velocity attenuation of {city} must be finite")
+    # Rainy workdays, when the commute may be affected
+    is_workday = np.arange(len(velocity_attenuation)) % 7 >= 2
+    rain_mask = (velocity_attenuation.astype(np.int64) != 1) & is_workday
 
     residential_consumption_proportion = 0.24  # country average
     transportation_consumption_proportion = 0.13
     average_saving_ratio = 0.335
 
-    workplace_data = pd.read_excel(f"../data/workplace/{city}.xlsx")
+    workplace_data = pd.read_parquet(f"../data/workplace/{city}.parquet")
     workplace_name = workplace_data["code"].tolist()
 
     return (
@@ -78,7 +91,8 @@ def get_city_data(city):
         average_income,
         income_range,
         monthly_disposable_income,
-        velocity_attenuation_percentage_list,
+        velocity_attenuation,
+        rain_mask,
         residential_consumption_proportion,
         transportation_consumption_proportion,
         average_saving_ratio,
@@ -86,24 +100,91 @@ def get_city_data(city):
     )
 
 
-def simulate(
+@njit(cache=True)
+def daily_commute(
+    velocity_attenuation,
+    rain_mask,
+    driving_fare,
+    transit_price,
+    driving_time,
+    transit_time,
+    driving_distance,
+    transit_distance,
+    income_per_hour,
+):
+    """
+    Calculate the daily commuting cost of a resident under rainfall, choosing between transit and driving each rainy workday.
+
+    :param velocity_attenuation: Array of the velocity attenuation percentage of each day
+    :param rain_mask: Boolean array marking the workdays with rain during the commute
+    :param driving_fare: Driving fare of the commute
+    :param transit_price: Transit price of the commute
+    :param driving_time: Driving time of the commute
+    :param transit_time: Transit time of the commute
+    :param driving_distance: Driving distance of the commute
+    :param transit_distance: Transit distance of the commute
+    :param income_per_hour: Hourly income of the resident
+
+    :return: Arrays of the daily commuting consumption, income loss, added commuting time, and added commuting distance
+    """
+    day_number = len(velocity_attenuation)
+    commuting_consumption = np.zeros(day_number)
+    income_lost = np.zeros(day_number)
+    time_add = np.zeros(day_number)
+    distance_add = np.zeros(day_number)
+    # Loop invariants of the resident's commute
+    hourly_income = max(income_per_hour, 10.0)
+    fare_difference = driving_fare - transit_price
+    time_difference = transit_time - driving_time
+    distance_difference = driving_distance - transit_distance
+
+    for r in range(day_number):
+        if not rain_mask[r]:  # Only rainy workdays change the commute
+            continue
+        velocity_factor = 1 / velocity_attenuation[r]
+
+        fare_add = fare_difference * velocity_factor  # Driving costs more than transit
+        income_loss = (
+            velocity_factor * hourly_income * time_difference / 60
+        )  # Transit loses more revenue than driving
+        if fare_add <= income_loss:
+            commuting_consumption[r] = fare_add
+            income_lost[r] = (
+                max(driving_time * velocity_factor - transit_time, 0.0)
+                / 60
+                * hourly_income
+            )
+            time_add[r] = driving_time * velocity_factor - transit_time
+            distance_add[r] = distance_difference
+        else:  # Best to choose the original commuting mode under rainfall
+            income_lost[r] = transit_time * velocity_factor / 60 * hourly_income
+            time_add[r] = transit_time * (velocity_factor - 1)
+
+    return commuting_consumption, income_lost, time_add, distance_add
+
+
+def simulate_workplace(
     city,
+    w,
     people,
     theta,
     min_consumption,
     rent_income_ratio,
     average_income,
     income_range,
-    velocity_attenuation_percentage_list,
+    monthly_disposable_income,
+    velocity_attenuation,
+    rain_mask,
     residential_consumption_proportion,
     transportation_consumption_proportion,
     average_saving_ratio,
     workplace_name,
 ):
     """
-    Simulate the wellbeing loss for the redidents from a given city.
+    Simulate the wellbeing loss for the redidents working at one work place of a given city.
 
     :param city: The name of the city
+    :param w: The index of the work place
     :param people: The number of simulation people for one income group in one work area
     :param theta: Well-being model coefficient
     :param min_consumption: Minimum consumption
@@ -111,209 +192,219 @@ def simulate(
     :param average_income: Average income
     :param income_range: Income range
     :param monthly_disposable_income: Monthly disposable income
-    :param velocity_attenuation_percentage_list: Velocity attenuation percentage list
+    :param velocity_attenuation: Velocity attenuation percentage array
+    :param rain_mask: Boolean array marking the rainy workdays
     :param residential_consumption_proportion: Residential consumption proportion
     :param transportation_consumption_proportion: Transportation consumption proportion
     :param average_saving_ratio: Average saving ratio
     :param workplace_name: List of workplace names
-    """
-    result_save_df = pd.DataFrame()
-
-    for w in range(4):
-        workplace = workplace_name[w]
-        df = pd.read_excel(f"./data/driving+transit/{city}/{city}_{workplace}.xlsx")
-        each_group_people_num = [people] * 5
-
-        for i in range(len(average_income)):
-            if income_range[i][0] > average_income[i]:
-                people_income_list = ei.get_people_income_list(
-                    [average_income[i] - 100, income_range[i][1]],
-                    average_income[i],
-                    people,
-                )
-            else:
-                people_income_list = ei.get_people_income_list(
-                    income_range[i], average_income[i], people
-                )
-
-            average_rent_income_ratio = rent_income_ratio[i]
-            actual_average_rent_income_ratio = 0  # Start
 
-            for p in tqdm(range(len(people_income_list))):
-                individual_income = people_income_list[p]
-                income_per_month, income_per_day, income_per_hour = (
-                    ei.get_individual_income(individual_income)
-                )
+    :return: Dataframe of the simulation result of each resident
+    """
+    workplace = workplace_name[w]
+    df = pd.read_parquet(f"./data/driving+transit/{city}/{city}_{workplace}.parquet")
+    df_sorted, prices = ei.sort_housing_by_rent(df)
+    distance_array = df_sorted["driving_distance"].to_numpy(dtype=np.float64)
+    time_array = df_sorted["driving_time"].to_numpy(dtype=np.float64)
+    fare_array = df_sorted["driving_fare"].to_numpy(dtype=np.float64)
+    transit_distance_array = df_sorted["commuting_distance"].to_numpy(dtype=np.float64)
+    transit_time_array = df_sorted["commuting_time"].to_numpy(dtype=np.float64)
+    transit_price_array = df_sorted["transit_price"].to_numpy(dtype=np.float64)
+    result_rows = []
+    rent_indices = []  # Row of the chosen rental property for each resident
+    each_group_people_num = [people] * 5
+
+    for i in range(len(average_income)):
+        if income_range[i][0] > average_income[i]:
+            people_income_list = ei.get_people_income_list(
+                [average_income[i] - 100, income_range[i][1]],
+                average_income[i],
+                people,
+            )
+        else:
+            people_income_list = ei.get_people_income_list(
+                income_range[i], average_income[i], people
+            )
+
+        people_income_array = np.asarray(people_income_list, dtype=np.float64)
+        income_per_month_array, income_per_day_array, income_per_hour_array = (
+            ei.get_individual_income(people_income_array)
+        )
+        average_rent_income_ratio = rent_income_ratio[i]
+        actual_average_rent_income_ratio = 0  # Start
+        rent_income_ratio_total = 0
+
+        for p in range(len(people_income_list)):
+            if p % PEOPLE_BATCH_SIZE == 0:
+                # The running ratio steers the rent range only at batch boundaries
+                if p > 0:
+                    actual_average_rent_income_ratio = rent_income_ratio_total / p
                 if actual_average_rent_income_ratio < average_rent_income_ratio:
-                    rent_income_ratio_range = [average_rent_income_ratio, 1]
+                    batch_rent_income_ratio_range = [average_rent_income_ratio, 1]
                 else:
-                    rent_income_ratio_range = [0, average_rent_income_ratio]
-                rent_range = [individual_income * i for i in rent_income_ratio_range]
-                rent_option = ei.get_housing_group(df, rent_range)
-
-                while len(rent_option) == 0:
-                    rent_income_ratio_range[0] -= 0.05
-                    rent_income_ratio_range[1] += 0.05
-                    rent_range = [
-                        individual_income * i for i in rent_income_ratio_range
-                    ]
-                    rent_option = ei.get_housing_group(df, rent_range)
-
-                distance = rent_option["driving_distance"]
-                time = rent_option["driving_time"]
-                rent = rent_option["individual_rent_price"]
-                prob = probability_normalize(distance, time, rent, 0.4, 0.4, 0.2)
-
-                rent_index = random.choices(range(len(prob)), weights=prob)
-
-                rent = rent_option.iloc[rent_index[0]]
-
-                # Initial deposit is the deposit of two years of work
-                savings = 2 * people_income_list[p] * average_saving_ratio
-                rent_per_month = rent["individual_rent_price"]
-                rent_per_day = rent_per_month / 30
-                actual_average_rent_income_ratio = (
-                    actual_average_rent_income_ratio * p
-                    + (rent_per_month / income_per_month)
-                ) / (p + 1)
-
-                extra_consumption_per_day = (
-                    rent_per_day / residential_consumption_proportion
-                ) * (
-                    1
-                    - residential_consumption_proportion
-                    - transportation_consumption_proportion
+                    batch_rent_income_ratio_range = [0, average_rent_income_ratio]
+                random_draws = ei.RNG.random(PEOPLE_BATCH_SIZE)
+
+            individual_income = people_income_list[p]
+            income_per_month = income_per_month_array[p]
+            income_per_day = income_per_day_array[p]
+            income_per_hour = income_per_hour_array[p]
+            rent_option = ei.get_nonempty_housing_slice(
+                prices, individual_income, batch_rent_income_ratio_range
+            )
+
+            prob = probability_normalize(
+                distance_array[rent_option],
+                time_array[rent_option],
+                prices[rent_option],
+                0.4,
+                0.4,
+                0.2,
+            )
+
+            # Inverse transform sampling of the chosen rental property
+            cdf = np.cumsum(prob)
+            if not np.isfinite(cdf[-1]):
+                raise ValueError(
+                    f"Weights of the rental properties for {city}_{workplace} "
+                    "must be finite"
                 )
+            cdf /= cdf[-1]
+            rent_index = int(
+                np.searchsorted(cdf, random_draws[p % PEOPLE_BATCH_SIZE], side="right")
+            )
+
+            idx = rent_option.start + rent_index
+            rent_indices.append(idx)
+
+            # Initial deposit is the deposit of two years of work
+            savings = 2 * people_income_list[p] * average_saving_ratio
+            rent_per_month = prices[idx]
+            rent_per_day = rent_per_month / 30
+            rent_income_ratio_total += rent_per_month / income_per_month
+
+            extra_consumption_per_day = (
+                rent_per_day / residential_consumption_proportion
+            ) * (
+                1
+                - residential_consumption_proportion
+                - transportation_consumption_proportion
+            )
+
+            transit_distance = transit_distance_array[idx]
+            transit_time = transit_time_array[idx]
+            transit_price = transit_price_array[idx]
+            driving_distance = distance_array[idx]
+            driving_time = time_array[idx]
+            driving_fare = fare_array[idx]
+
+            initial_disposable_consumption = max(
+                income_per_day, min_consumption
+            )  # Max(daily income, min_consumption)
+
+            (
+                commuting_consumption,
+                income_lost,
+                time_add_per_day,
+                distance_add_per_day,
+            ) = daily_commute(
+                velocity_attenuation,
+                rain_mask,
+                driving_fare,
+                transit_price,
+                driving_time,
+                transit_time,
+                driving_distance,
+                transit_distance,
+                float(income_per_hour),
+            )
+            consumption, asset_lost_per_day = ei.get_consumption(
+                initial_disposable_consumption,
+                rent_per_day,
+                income_per_day,
+                extra_consumption_per_day,
+                average_saving_ratio,
+                commuting_consumption,
+                income_lost,
+            )
+            # Without rainfall the daily consumption is the same every day
+            consumption_no_rainfall, _ = ei.get_consumption(
+                initial_disposable_consumption,
+                rent_per_day,
+                income_per_day,
+                extra_consumption_per_day,
+                average_saving_ratio,
+                0,
+                0,
+            )
+
+            # Disposable assets at the end of each day
+            disposable_asset = savings + np.cumsum(consumption)
+            disposable_asset_no_rainfall = (
+                savings + consumption_no_rainfall * np.arange(1, len(consumption) + 1)
+            )
+            well_being_loss = ei.get_wellbeing_loss(
+                disposable_asset, disposable_asset_no_rainfall, theta
+            )
+
+            result_rows.append(
+                {
+                    "people_income": individual_income,
+                    "workplace": w + 1,
+                    "initial_savings": savings,
+                    "income_group": i + 1,
+                    "people": p + 1,
+                    "well_being_loss": max(well_being_loss.sum(), 0),
+                    "asset_loss": asset_lost_per_day.sum(),
+                    "time_add": time_add_per_day.sum(),
+                    "distance_add": distance_add_per_day.sum(),
+                }
+            )
+
+        actual_average_rent_income_ratio = rent_income_ratio_total / len(
+            people_income_list
+        )
+        print(f"{city} + income group {i + 1} + {actual_average_rent_income_ratio}")
 
-                transit_distance = rent["commuting_distance"]
-                transit_time = rent["commuting_time"]
-                transit_price = rent["transit_price"]
-                driving_distance = rent["driving_distance"]
-                driving_time = rent["driving_time"]
-                driving_fare = rent["driving_fare"]
+    # Attach the chosen rental properties in one gather instead of per resident
+    rent_df = df_sorted.iloc[rent_indices].reset_index(drop=True)
+    result_df = pd.concat([rent_df, pd.DataFrame(result_rows)], axis=1)
+    return result_df
 
-                initial_disposable_consumption = max(
-                    income_per_day, min_consumption
-                )  # Max(daily income, min_consumption)
 
-                consumption = []
-                asset = [savings]  # Set initial asset
+def share_array(array):
+    """
+    Copy an array into a new shared memory block, so worker processes can attach to it by name instead of unpickling a copy.
 
-                well_being_loss = []
-                consumption_no_rainfall = []
+    :param array: The array to publish
 
-                asset_lost_per_day = []
-                time_add_per_day = []
-                distance_add_per_day = []
+    :return: The shared memory block, to be unlinked by the caller, and the descriptor of the shared array
+    """
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    shared = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    shared[...] = array
+    del shared  # Release the view so the block can be closed
+    return shm, SharedArray(shm.name, array.dtype.str, array.shape)
 
-                for r in range(len(velocity_attenuation_percentage_list)):
-                    velocity_attenuation_percentage = (
-                        velocity_attenuation_percentage_list[r]
-                    )
-                    if r % 7 == 0 or r % 7 == 1:  # Determine whether it is a work day
-                        commuting_consumption = 0
-                        income_lost = 0
-                        time_add = 0
-                        distance_add = 0
-                    else:
-                        if (
-                            int(velocity_attenuation_percentage) == 1
-                        ):  # If it's a weekday, determine if it rains during your commute
-                            commuting_consumption = 0
-                            income_lost = 0
-                            time_add = 0
-                            distance_add = 0
-                        else:
-                            fare_add = (
-                                driving_fare - transit_price
-                            ) / velocity_attenuation_percentage  # Driving costs more than transit
-                            income_loss = (
-                                (1 / velocity_attenuation_percentage)
-                                * max(income_per_hour, 10)
-                                * (transit_time - driving_time)
-                                / 60
-                            )  # Transit loses more revenue than driving
-                            if fare_add <= income_loss:
-                                commuting_consumption = fare_add
-                                income_lost = (
-                                    max(
-                                        driving_time / velocity_attenuation_percentage
-                                        - transit_time,
-                                        0,
-                                    )
-                                    / 60
-                                    * max(income_per_hour, 10)
-                                )
-                                time_add = (
-                                    driving_time * (1 / velocity_attenuation_percentage)
-                                    - transit_time
-                                )
-                                distance_add = driving_distance - transit_distance
-                            else:  # Best to choose the original commuting mode under rainfall
-                                commuting_consumption = 0
-                                income_lost = (
-                                    transit_time
-                                    / (60 * velocity_attenuation_percentage)
-                                    * max(income_per_hour, 10)
-                                )
-                                time_add = transit_time * (
-                                    1 / velocity_attenuation_percentage - 1
-                                )
-                                distance_add = 0
-
-                    consumption_today, asset_lost_today = ei.get_consumption(
-                        initial_disposable_consumption,
-                        rent_per_day,
-                        income_per_day,
-                        extra_consumption_per_day,
-                        average_saving_ratio,
-                        commuting_consumption,
-                        income_lost,
-                    )
-                    consumption_today_no_rainfall = ei.get_consumption(
-                        initial_disposable_consumption,
-                        rent_per_day,
-                        income_per_day,
-                        extra_consumption_per_day,
-                        average_saving_ratio,
-                        0,
-                        0,
-                    )
 
-                    consumption.append(consumption_today)
-                    consumption_no_rainfall.append(consumption_today_no_rainfall)
-                    disposable_asset_today = savings + sum(consumption)
-                    disposable_asset_today_no_rainfall = savings + sum(
-                        consumption_no_rainfall
-                    )
-                    asset.append(disposable_asset_today)
-                    well_being_today, well_being_loss_today = ei.get_wellbeing(
-                        disposable_asset_today,
-                        disposable_asset_today_no_rainfall,
-                        theta,
-                    )
-                    asset_lost_per_day.append(asset_lost_today)
-                    time_add_per_day.append(time_add)
-                    distance_add_per_day.append(distance_add)
-                    well_being_loss.append(well_being_loss_today)
-
-                rent_df = rent.to_frame().T
-                result_df_1 = rent_df.assign(
-                    people_income=individual_income,
-                    workplace=w + 1,
-                    initial_savings=savings,
-                    income_group=i + 1,
-                    people=p + 1,
-                    well_being_loss=max(sum(well_being_loss), 0),
-                    asset_loss=sum(asset_lost_per_day),
-                    time_add=sum(time_add_per_day),
-                    distance_add=sum(distance_add_per_day),
-                )
-                result_dave_df = pd.concat([result_save_df, result_df_1], axis=0)
+def simulate_shared_workplace(*args):
+    """
+    Run simulate_workplace in a worker process, viewing the arguments published with share_array in place. Each block is attached once per worker and left open for the life of the worker, so a view kept alive by a failed simulation can never outlive its block.
 
-            print(f"{city} + income group {i + 1} + {actual_average_rent_income_ratio}")
+    :param args: The arguments of simulate_workplace, where arrays may be given as shared array descriptors
 
-    result_dave_df.to_excel(f"./data/result/{city}/{city}{w + 1}.xlsx", index=False)
+    :return: Dataframe of the simulation result of each resident
+    """
+    workplace_args = []
+    for arg in args:
+        if isinstance(arg, SharedArray):
+            # The view stays valid because the block is never closed by the worker
+            if arg.name not in attached_blocks:
+                attached_blocks[arg.name] = shared_memory.SharedMemory(name=arg.name)
+            shm = attached_blocks[arg.name]
+            arg = np.ndarray(arg.shape, dtype=arg.dtype, buffer=shm.buf)
+        workplace_args.append(arg)
+    return simulate_workplace(*workplace_args)
 
 
 def merge_city():
@@ -325,12 +416,19 @@ def merge_city():
         folder_path = f"./data/result/{city}"
         dfs = []
         for file_name in os.listdir(folder_path):
-            if file_name.endswith(".xlsx"):
+            if file_name.endswith(".parquet"):
                 file_path = os.path.join(folder_path, file_name)
-                df = pd.read_excel(file_path)
+                df = pd.read_parquet(file_path)
                 dfs.append(df)
         merged_df = pd.concat(dfs, ignore_index=True)
-        merged_df.to_excel(f"./data/result/{city}.xlsx", index=False)
+        ei.write_parquet(merged_df, f"./data/result/{city}.parquet")
+
+
+def init_worker():
+    """
+    Give each worker process its own random stream, since forked workers would otherwise share the parent's generator state.
+    """
+    ei.RNG = np.random.default_rng()
 
 
 if __name__ == "__main__":
@@ -339,38 +437,41 @@ if __name__ == "__main__":
     people = 5000
     theta_select = 1.5
 
-    for city in tqdm(city_list):
-        theta = theta_select
-        city_dir = f"./data/result/{city}"
-        os.makedirs(city_dir, exist_ok=True)
-
-        (
-            min_consumption,
-            rent_income_ratio,
-            average_income,
-            income_range,
-            monthly_disposable_income,
-            velocity_attenuation_percentage_list,
-            residential_consumption_proportion,
-            transportation_consumption_proportion,
-            average_saving_ratio,
-            workplace_name,
-        ) = get_city_data(city)
-
-        simulate(
-            city,
-            people,
-            theta,
-            min_consumption,
-            rent_income_ratio,
-            average_income,
-            income_range,
-            monthly_disposable_income,
-            velocity_attenuation_percentage_list,
-            residential_consumption_proportion,
-            transportation_consumption_proportion,
-            average_saving_ratio,
-            workplace_name,
-        )
+    shared_blocks = []
+    try:
+        with ProcessPoolExecutor(
+            max_workers=os.cpu_count(), initializer=init_worker
+        ) as executor:
+            futures = {}
+            for city in city_list:
+                os.makedirs(f"./data/result/{city}", exist_ok=True)
+                # The city-level arrays are published once and attached by every worker
+                city_data = []
+                for value in get_city_data(city):
+                    if isinstance(value, np.ndarray):
+                        shm, value = share_array(value)
+                        shared_blocks.append(shm)
+                    city_data.append(value)
+                for w in range(4):
+                    future = executor.submit(
+                        simulate_shared_workplace,
+                        city,
+                        w,
+                        people,
+                        theta_select,
+                        *city_data,
+                    )
+                    futures[future] = (city, w)
+
+            for future in tqdm(as_completed(futures), total=len(futures)):
+                city, w = futures[future]
+                result_df = future.result()
+                ei.write_parquet(
+                    result_df, f"./data/result/{city}/{city}{w + 1}.parquet"
+                )
+    finally:
+        for shm in shared_blocks:
+            shm.close()
+            shm.unlink()
 
     merge_city()